@@ -1,37 +1,69 @@
-import sys, os, tty, termios, traceback
+import sys, os, tty, termios, traceback, select
 from typing import Callable
 
 
 class History:
-    def __init__(self, circular: bool = True):
+    def __init__(self, circular: bool = True, capacity: int = 1000):
+        if capacity < 1:
+            raise ValueError(f'capacity must be at least 1, got {capacity}')
         self.circular: bool = circular
+        self.capacity: int = capacity
         self._index: int = 0
-        self._buffer: list[str] = []
+        self._head: int = 0
+        self._count: int = 0
+        self._buffer: list[tuple[str, bytes] | None] = [None] * capacity
+        self._cached_index: int = -1
+        self._cached_val: tuple[str, bytes] = ("", b"")
+
+    def _entry(self) -> tuple[str, bytes]:
+        """ Return the current entry as (text, encoded text) """
+        if self._index == self._cached_index:
+            return self._cached_val
+        if self._index < self._count and self._index >= 0:
+            val = self._buffer[(self._head + self._index) % self.capacity] or ("", b"")
+        else:
+            val = ("", b"")
+        self._cached_index, self._cached_val = self._index, val
+        return val
 
     def _get(self) -> str:
-        if self._index < len(self._buffer) and self._index >= 0:
-            return self._buffer[self._index]
-        else:
-            return ""
+        return self._entry()[0]
+
+    def current_bytes(self) -> bytes:
+        """ Encoded form of the current entry, for writing to the terminal """
+        return self._entry()[1]
 
     def next(self) -> str:
-        if self.circular and self._index == len(self._buffer):
-            self._index = 0
-        elif self._index < len(self._buffer):
-            self._index += 1;
+        n = self._count
+        if self.circular:
+            self._index = (self._index + 1) % (n + 1)
+        else:
+            self._index = min(self._index + 1, n)
         return self._get()
 
     def prev(self) -> str:
-        if self.circular and self._index == 0:
-            self._index = len(self._buffer)
-        elif self._index > 0:
-            self._index -= 1
+        n = self._count
+        if self.circular:
+            self._index = (self._index - 1) % (n + 1)
+        else:
+            self._index = max(self._index - 1, 0)
         return self._get()
 
     def push(self, string: str) -> None:
-        if string and (not self._buffer or self._buffer[-1] != string):
-            self._buffer.append(string)
-            self._index = len(self._buffer)
+        if not string:
+            return
+        last = self._buffer[(self._head + self._count - 1) % self.capacity]
+        if self._count and last is not None and last[0] == string:
+            return
+        entry = (string, string.encode())
+        if self._count < self.capacity:
+            self._buffer[(self._head + self._count) % self.capacity] = entry
+            self._count += 1
+        else:
+            self._buffer[self._head] = entry
+            self._head = (self._head + 1) % self.capacity
+        self._index = self._count
+        self._cached_index = -1
 
 
 def _write(msg: str, nl: bool = False, flush: bool = False) -> None:
@@ -43,97 +75,158 @@ def _write(msg: str, nl: bool = False, flush: bool = False) -> None:
         _flush()
 
 
+def _write_bytes(data: bytes | bytearray) -> None:
+    """ Write raw bytes to stdout, bypassing the text layer encoding """
+    _ = sys.stdout.buffer.write(data)
+
+
 def _flush() -> None:
     """ Wrap sys.stdout.flush to avoid reportUnusedCallResult """
     _ = sys.stdout.flush()
 
 
-def _clear_buf(l: int) -> None:
-    _write('\r')
-    _write(' ' * l)
-    _write('\r')
-
-
-def _get_unix_key() -> int:
-    k = os.read(sys.stdin.fileno(), 3).decode()
-    match len(k):
-        case 3:
-            k = ord(k[-1])
-            return -k if k == 65 or k == 66 else k
-        case 1:
-            return ord(k)
-        case _:
-            return ord(k[-1])
-
-
 class Shell:
 
     def __init__(self, prompt: str = "> ", history: History | None = None):
-        self.prompt: str = prompt
+        self.prompt = prompt
         self.history: History = History(circular=False) if history is None else history
         self.cmds: dict[str, Callable[[list[str]], int]] = {}
+        self._keymap: dict[int, Callable[[bytearray, int], bytes]] = {
+            -65: self._on_up,
+            -66: self._on_down,
+            9: self._on_tab,
+            10: self._on_ret,
+            27: self._noop, # lone ESC
+            67: self._noop, # ignore left/right arrow keys
+            68: self._noop,
+            127: self._on_del,
+        }
+
+    @property
+    def prompt(self) -> str:
+        return self._prompt
+
+    @prompt.setter
+    def prompt(self, prompt: str) -> None:
+        self._prompt: str = prompt
+        self._prompt_bytes: bytes = prompt.encode()
+
+    def _redraw(self, buf: bytearray) -> bytes:
+        """ Erase the current line (ANSI EL), then redraw prompt and buf """
+        return b''.join((b'\r\x1b[K', self._prompt_bytes, buf))
+
+    def _on_up(self, buf: bytearray, key: int) -> bytes:
+        _ = self.history.prev()
+        pbuf = self.history.current_bytes()
+        if pbuf == buf:
+            return b''
+        buf[:] = pbuf
+        return self._redraw(buf)
+
+    def _on_down(self, buf: bytearray, key: int) -> bytes:
+        _ = self.history.next()
+        nbuf = self.history.current_bytes()
+        if nbuf == buf:
+            return b''
+        buf[:] = nbuf
+        return self._redraw(buf)
+
+    def _on_tab(self, buf: bytearray, key: int) -> bytes:
+        return b"tab"
+
+    def _on_ret(self, buf: bytearray, key: int) -> bytes:
+        if not buf:
+            return b'\n' + self._prompt_bytes
+        _write_bytes(b'\n')
+        cmdstr = buf.decode(errors='replace')
+        self.history.push(cmdstr)
+        self._exec(cmdstr)
+        buf.clear()
+        _flush()
+        return self._prompt_bytes
+
+    def _on_del(self, buf: bytearray, key: int) -> bytes:
+        if not buf:
+            return b''
+        # drop the whole UTF-8 character, not just its last byte
+        while buf and buf[-1] & 0xC0 == 0x80:
+            del buf[-1]
+        if buf:
+            del buf[-1]
+        return self._redraw(buf)
+
+    def _on_char(self, buf: bytearray, key: int) -> bytes:
+        buf.append(key)
+        return bytes((key,))
+
+    def _noop(self, buf: bytearray, key: int) -> bytes:
+        return b''
 
     def _exec(self, cmdstr: str) -> None:
         """ cmd fields: cmd_name args """
-        acmd = cmdstr.split()
+        acmd = cmdstr.split(None, 1)
+        if not acmd:
+            return
         cmd_name = acmd[0]
-        try:
-            cmd = self.cmds[cmd_name]
-        except KeyError:
+        cmd = self.cmds.get(cmd_name)
+        if cmd is None:
             _write(f'{cmd_name}: command not found', nl=True)
-        else:
-            try:
-                _ = cmd(acmd[1:])
-            except Exception as e:
-                _write(traceback.format_exc(), nl=True)
+            return
+        try:
+            _ = cmd(acmd[1].split() if len(acmd) > 1 else [])
+        except Exception as e:
+            _write(traceback.format_exc(), nl=True)
 
     def start(self) -> None:
         fd = sys.stdin.fileno()
+        _read = os.read
+        _select = select.select
+        _stdout_write = sys.stdout.buffer.write
+        _stdout_flush = sys.stdout.buffer.flush
+        inbuf = bytearray()
+        inpos = 0
+
+        def get_key() -> int:
+            """ Return the next key, refilling the input buffer only when drained """
+            nonlocal inpos
+            if inpos == len(inbuf):
+                chunk = _read(fd, 256)
+                if not chunk:
+                    raise EOFError
+                inbuf[:] = chunk
+                inpos = 0
+                # slurp whatever else is already pending (paste, held keys)
+                while _select([fd], [], [], 0)[0]:
+                    chunk = _read(fd, 4096)
+                    if not chunk:
+                        break
+                    inbuf.extend(chunk)
+            k = inbuf[inpos]
+            if k == 0x1b:
+                left = len(inbuf) - inpos
+                if left >= 3:
+                    k = inbuf[inpos + 2]
+                    inpos += 3
+                    return -k if k == 65 or k == 66 else k
+                if left == 2:
+                    # alt+key: drop the ESC, keep the key
+                    inpos += 2
+                    return inbuf[inpos - 1]
+            inpos += 1
+            return k
+
         old_tty_attrs = tty.setcbreak(fd, termios.TCSANOW)
         try:
-            _write(self.prompt)
-            _flush()
-            buf = ''
+            _ = _stdout_write(self._prompt_bytes)
+            _stdout_flush()
+            buf = bytearray()
+            keymap_get = self._keymap.get
+            on_char = self._on_char
             while True:
-                key = _get_unix_key()
-                match key:
-                    case -65: # up
-                        pbuf = self.history.prev()
-                        if not pbuf and not buf:
-                            continue
-                        _clear_buf(len(buf) + len(self.prompt))
-                        buf = pbuf
-                        _write(self.prompt)
-                        _write(buf)
-                    case -66: # down
-                        nbuf = self.history.next()
-                        if not pbuf and not buf:
-                            continue
-                        _clear_buf(len(buf) + len(self.prompt))
-                        buf = nbuf
-                        _write(self.prompt)
-                        _write(buf)
-                    case 9: # tab
-                        _write("tab")
-                    case 10: # ret
-                        _write('\n')
-                        if buf:
-                            self.history.push(buf)
-                            self._exec(buf)
-                            buf = ''
-                        _write(self.prompt)
-                    case 67 | 68: # ignore left/right arrow keys
-                        pass
-                    case 127: # del
-                        if buf:
-                            _clear_buf(len(buf) + len(self.prompt))
-                            _write(self.prompt)
-                            buf = buf[:-1]
-                            _write(buf)
-                    case _:
-                        c = chr(key)
-                        buf = buf + chr(key)
-                        _write(c)
-                _flush()
+                key = get_key()
+                out = keymap_get(key, on_char)(buf, key)
+                if out:
+                    _ = _stdout_write(out)
+                    _stdout_flush()
         finally:
             termios.tcsetattr(fd, termios.TCSANOW, old_tty_attrs)